@@ -0,0 +1,51 @@
+import time
+import asyncio
+import hashlib
+from cachetools import TTLCache
+from agent.db import verify_token
+
+
+# Verified users keyed by SHA-256 of the token (never the raw token). Each
+# entry also carries its own deadline so a token is never served past `exp`.
+_TTL = 5
+_cache: TTLCache = TTLCache(maxsize=10_000, ttl=_TTL)
+# Rejected tokens are remembered briefly so a client retrying a bad token in
+# a loop doesn't hit Supabase on every attempt.
+_NEGATIVE_TTL = 1
+_failures: TTLCache = TTLCache(maxsize=10_000, ttl=_NEGATIVE_TTL)
+_lock = asyncio.Lock()
+# One verification per token at a time; concurrent callers share its result.
+_inflight: dict[bytes, asyncio.Task] = {}
+
+
+async def _verify_and_store(token: str, key: bytes) -> dict | None:
+    verified = await verify_token(token)
+    async with _lock:
+        if not verified:
+            _failures[key] = True
+            return None
+        user, claims = verified
+        expires_at = min(float(claims.get("exp", 0)), time.time() + _TTL)
+        if expires_at > time.time():
+            _cache[key] = (user, expires_at)
+    return user
+
+
+async def cached_verify_token(token: str) -> dict | None:
+    """verify_token with short-lived positive/negative caching and request coalescing."""
+    key = hashlib.sha256(token.encode()).digest()
+    async with _lock:
+        entry = _cache.get(key)
+        failed = key in _failures
+    if entry and entry[1] > time.time():
+        return entry[0]
+    if failed:
+        return None
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_verify_and_store(token, key))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # Shielded so one caller going away doesn't cancel the shared verification
+    return await asyncio.shield(task)
@@ -1,24 +1,69 @@
 import os
 import asyncio
-from supabase import create_client, Client
-
-
-def get_supabase() -> Client:
+import contextlib
+import httpx
+import jwt
+import orjson
+from datetime import datetime
+from uuid import UUID
+from postgrest.types import ReturnMethod
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from agent.db_pool import get_pool
+
+
+# Read once at import so a misconfigured deployment fails at boot, not on
+# the first request.
+SUPABASE_URL = os.environ.get("SUPABASE_URL", "")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY", "")
+# Required: research_sessions has RLS enabled (migrations/004) with no anon
+# policies, so the PostgREST fallback must run as service_role.
+SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_KEY", "")
+# Optional: the project's JWT secret lets verify_token skip the GoTrue round trip
+SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET", "")
+if not SUPABASE_URL or not SUPABASE_KEY:
+    raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in your .env file")
+if not SUPABASE_SERVICE_KEY:
+    raise ValueError("SUPABASE_SERVICE_KEY must be set in your .env file")
+
+# One keep-alive HTTP/2 pool shared by every GoTrue and PostgREST call, so
+# auth and session CRUD skip the TLS handshake after the first request.
+HTTP = httpx.AsyncClient(
+    http2=True,
+    timeout=5.0,
+    follow_redirects=True,
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+)
+
+# Clients are memoized so every helper reuses the same GoTrue/PostgREST
+# objects instead of rebuilding them on each call. Sessions are never
+# persisted or refreshed on the shared clients since they serve many users.
+_CLIENT_OPTIONS = AsyncClientOptions(
+    persist_session=False, auto_refresh_token=False, httpx_client=HTTP,
+)
+_clients: dict[str, AsyncClient] = {}
+_clients_lock = asyncio.Lock()
+
+
+async def _get_client(name: str, key: str) -> AsyncClient:
+    async with _clients_lock:
+        if name not in _clients:
+            _clients[name] = await acreate_client(SUPABASE_URL, key, options=_CLIENT_OPTIONS)
+        return _clients[name]
+
+
+async def get_supabase() -> AsyncClient:
     """Client with anon key — used for auth operations."""
-    url = os.environ.get("SUPABASE_URL")
-    key = os.environ.get("SUPABASE_KEY")
-    if not url or not key:
-        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in your .env file")
-    return create_client(url, key)
+    return _clients.get("anon") or await _get_client("anon", SUPABASE_KEY)
 
 
-def get_supabase_admin() -> Client:
+async def get_supabase_admin() -> AsyncClient:
     """Client with service_role key — bypasses RLS for server-side DB operations."""
-    url = os.environ.get("SUPABASE_URL")
-    key = os.environ.get("SUPABASE_SERVICE_KEY", os.environ.get("SUPABASE_KEY"))
-    if not url or not key:
-        raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set in your .env file")
-    return create_client(url, key)
+    return _clients.get("admin") or await _get_client("admin", SUPABASE_SERVICE_KEY)
+
+
+async def close_http() -> None:
+    """Close the shared HTTP pool on shutdown."""
+    await HTTP.aclose()
 
 
 
@@ -33,23 +78,72 @@ def _extract_data(response):
     return None
 
 
+def _record_to_dict(record) -> dict:
+    """Convert an asyncpg Record to the JSON-friendly shape PostgREST returns."""
+    row = dict(record)
+    for k, v in row.items():
+        if isinstance(v, datetime):
+            row[k] = v.isoformat()
+        elif isinstance(v, UUID):
+            row[k] = str(v)
+    return row
+
+
+@contextlib.asynccontextmanager
+async def _as_user(pool, user_id: str):
+    """Acquire a pooled connection that runs under Supabase's RLS as `user_id`.
+
+    The pool connects with a privileged role, so each read/delete runs in a
+    transaction with the `authenticated` role and JWT claims that auth.uid()
+    resolves, mirroring what PostgREST does for a user token. That costs two
+    extra round trips (BEGIN/COMMIT) plus the set_config call per query, in
+    exchange for having Postgres enforce the user scope.
+    """
+    claims = orjson.dumps({"sub": user_id, "role": "authenticated"}).decode()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "SELECT set_config('role', 'authenticated', true), "
+                "set_config('request.jwt.claims', $1, true), "
+                "set_config('request.jwt.claim.sub', $2, true)",
+                claims, user_id,
+            )
+            yield conn
+
+
 # ──────────────────────────────────────────────
 #  Auth helpers
 # ──────────────────────────────────────────────
 
-async def verify_token(token: str) -> dict | None:
-    """Validate a Supabase access token and return the user dict.
+def _decode_token(token: str) -> dict:
+    """Verify and decode a Supabase access token in a single PyJWT call."""
+    return jwt.decode(
+        token,
+        SUPABASE_JWT_SECRET,
+        algorithms=["HS256"],
+        audience="authenticated",
+        options={"require": ["exp", "sub", "aud"], "verify_aud": True},
+    )
 
-    Returns the user dict on success, or None on failure.
+
+async def verify_token(token: str) -> tuple[dict, dict] | None:
+    """Validate a Supabase access token and return (user dict, JWT claims).
+
+    With SUPABASE_JWT_SECRET set the token is verified locally; otherwise
+    GoTrue verifies it and the claims are read without re-verifying. Returns
+    None on failure. Callers on the request path should go through
+    agent.auth_cache.cached_verify_token.
     """
     try:
-        def _verify():
-            sb = get_supabase()
-            return sb.auth.get_user(token)
+        if SUPABASE_JWT_SECRET:
+            claims = _decode_token(token)
+            return {"id": claims["sub"], "email": claims.get("email")}, claims
 
-        response = await asyncio.to_thread(_verify)
+        sb = await get_supabase()
+        response = await sb.auth.get_user(token)
         if response and hasattr(response, "user") and response.user:
-            return {"id": response.user.id, "email": response.user.email}
+            claims = jwt.decode(token, options={"verify_signature": False})
+            return {"id": response.user.id, "email": response.user.email}, claims
         return None
     except Exception as e:
         print(f"[AUTH] Token verification failed: {e}")
@@ -59,11 +153,8 @@ async def verify_token(token: str) -> dict | None:
 async def sign_up(email: str, password: str) -> dict:
     """Register a new user with email and password."""
     try:
-        def _signup():
-            sb = get_supabase()
-            return sb.auth.sign_up({"email": email, "password": password})
-
-        response = await asyncio.to_thread(_signup)
+        sb = await get_supabase()
+        response = await sb.auth.sign_up({"email": email, "password": password})
         if response and hasattr(response, "user") and response.user:
             session = response.session
             # If Supabase returns a session (email confirmation disabled), use it
@@ -84,11 +175,8 @@ async def sign_up(email: str, password: str) -> dict:
 async def sign_in(email: str, password: str) -> dict:
     """Sign in an existing user with email and password."""
     try:
-        def _signin():
-            sb = get_supabase()
-            return sb.auth.sign_in_with_password({"email": email, "password": password})
-
-        response = await asyncio.to_thread(_signin)
+        sb = await get_supabase()
+        response = await sb.auth.sign_in_with_password({"email": email, "password": password})
         if response and hasattr(response, "user") and response.user:
             session = response.session
             return {
@@ -107,17 +195,28 @@ async def sign_in(email: str, password: str) -> dict:
 # ──────────────────────────────────────────────
 
 async def save_session(query: str, report: str, user_id: str) -> dict:
-    """Save a completed research session to Supabase, linked to a user."""
+    """Save a completed research session to Supabase, linked to a user.
+
+    Returns the new row's `id` and `created_at` from the insert itself, so
+    callers never need a follow-up read.
+    """
     try:
-        def _save():
-            sb = get_supabase_admin()
-            return sb.table("research_sessions").insert({
-                "query": query,
-                "report": report,
-                "user_id": user_id,
-            }).execute()
-
-        response = await asyncio.to_thread(_save)
+        pool = await get_pool()
+        if pool is not None:
+            async with pool.acquire() as conn:
+                row = await conn.fetchrow(
+                    "INSERT INTO research_sessions (query, report, user_id) "
+                    "VALUES ($1, $2, $3) RETURNING id, created_at",
+                    query, report, user_id,
+                )
+            return _record_to_dict(row) if row else {}
+
+        sb = await get_supabase_admin()
+        response = await sb.table("research_sessions").insert({
+            "query": query,
+            "report": report,
+            "user_id": user_id,
+        }).select("id, created_at").execute()
         data = _extract_data(response)
         if data:
             return data[0] if isinstance(data, list) else data
@@ -127,43 +226,115 @@ async def save_session(query: str, report: str, user_id: str) -> dict:
         return {}
 
 
-async def list_sessions(user_id: str) -> list:
-    """List research sessions for a specific user, newest first."""
+async def save_sessions(rows: list[tuple[str, str, str]]) -> bool:
+    """Bulk-save (query, report, user_id) rows in a single round trip."""
+    if not rows:
+        return True
+    try:
+        pool = await get_pool()
+        if pool is not None:
+            async with pool.acquire() as conn:
+                await conn.executemany(
+                    "INSERT INTO research_sessions (query, report, user_id) "
+                    "VALUES ($1, $2, $3)",
+                    rows,
+                )
+            return True
+
+        sb = await get_supabase_admin()
+        await sb.table("research_sessions").insert([
+            {"query": query, "report": report, "user_id": user_id}
+            for query, report, user_id in rows
+        ], returning=ReturnMethod.minimal).execute()
+        return True
+    except Exception as e:
+        print(f"[DB] Failed to save {len(rows)} sessions: {e}")
+        return False
+
+
+async def list_sessions(
+    user_id: str, cursor: tuple[str, int] | None = None, limit: int = 20
+) -> dict:
+    """List research sessions for a specific user, newest first.
+
+    Uses keyset pagination on (created_at, id): pass the previous page's
+    `next_cursor` to fetch the page after it. Relies on the
+    ix_research_sessions_user_created index (see migrations/). Raises
+    ValueError for a malformed cursor rather than returning an empty page.
+    """
+    after = None
+    if cursor:
+        after = (datetime.fromisoformat(cursor[0]), int(cursor[1]))
+
     try:
-        def _list():
-            sb = get_supabase_admin()
-            return (
+        pool = await get_pool()
+        if pool is not None:
+            async with _as_user(pool, user_id) as conn:
+                if after:
+                    rows = await conn.fetch(
+                        "SELECT id, query, created_at FROM research_sessions "
+                        "WHERE user_id = $1 AND (created_at, id) < ($2, $3) "
+                        "ORDER BY created_at DESC, id DESC LIMIT $4",
+                        user_id, after[0], after[1], limit,
+                    )
+                else:
+                    rows = await conn.fetch(
+                        "SELECT id, query, created_at FROM research_sessions "
+                        "WHERE user_id = $1 ORDER BY created_at DESC, id DESC LIMIT $2",
+                        user_id, limit,
+                    )
+            data = [_record_to_dict(r) for r in rows]
+        else:
+            sb = await get_supabase_admin()
+            q = (
                 sb.table("research_sessions")
                 .select("id, query, created_at")
                 .eq("user_id", user_id)
-                .order("created_at", desc=True)
-                .limit(20)
+            )
+            if after:
+                created_at, last_id = after[0].isoformat(), after[1]
+                q = q.or_(
+                    f'created_at.lt."{created_at}",'
+                    f'and(created_at.eq."{created_at}",id.lt.{last_id})'
+                )
+            response = await (
+                q.order("created_at", desc=True)
+                .order("id", desc=True)
+                .limit(limit)
                 .execute()
             )
+            data = _extract_data(response) or []
 
-        response = await asyncio.to_thread(_list)
-        data = _extract_data(response)
-        return data or []
+        next_cursor = None
+        if len(data) == limit:
+            last = data[-1]
+            next_cursor = (last["created_at"], last["id"])
+        return {"items": data, "next_cursor": next_cursor}
     except Exception as e:
         print(f"[DB] Failed to list sessions: {e}")
-        return []
+        return {"items": [], "next_cursor": None}
 
 
-async def get_session_by_id(session_id: int, user_id: str) -> dict:
-    """Retrieve a specific session by ID, scoped to the user."""
+async def _get_session(session_id: int, user_id: str, columns: str) -> dict:
     try:
-        def _get():
-            sb = get_supabase_admin()
-            return (
-                sb.table("research_sessions")
-                .select("*")
-                .eq("id", session_id)
-                .eq("user_id", user_id)
-                .single()
-                .execute()
-            )
-
-        response = await asyncio.to_thread(_get)
+        pool = await get_pool()
+        if pool is not None:
+            async with _as_user(pool, user_id) as conn:
+                row = await conn.fetchrow(
+                    f"SELECT {columns} FROM research_sessions WHERE id = $1 AND user_id = $2",
+                    session_id, user_id,
+                )
+            return _record_to_dict(row) if row else {}
+
+        sb = await get_supabase_admin()
+        response = await (
+            sb.table("research_sessions")
+            .select(columns)
+            .eq("id", session_id)
+            .eq("user_id", user_id)
+            .single()
+            .execute()
+        )
         data = _extract_data(response)
         return data or {}
     except Exception as e:
@@ -171,22 +342,35 @@ async def get_session_by_id(session_id: int, user_id: str) -> dict:
         return {}
 
 
+async def get_session_full(session_id: int, user_id: str) -> dict:
+    """Retrieve a specific session including its report, scoped to the user."""
+    return await _get_session(session_id, user_id, "id, query, report, created_at")
+
+
 async def delete_session(session_id: int, user_id: str) -> bool:
-    """Delete a specific session, scoped to the user."""
-    try:
-        def _delete():
-            sb = get_supabase_admin()
-            return (
-                sb.table("research_sessions")
-                .delete()
-                .eq("id", session_id)
-                .eq("user_id", user_id)
-                .execute()
-            )
+    """Delete a specific session, scoped to the user.
 
-        await asyncio.to_thread(_delete)
+    Looks up by the primary key on `id`; see migrations/003.
+    """
+    try:
+        pool = await get_pool()
+        if pool is not None:
+            async with _as_user(pool, user_id) as conn:
+                await conn.execute(
+                    "DELETE FROM research_sessions WHERE id = $1 AND user_id = $2",
+                    session_id, user_id,
+                )
+            return True
+
+        sb = await get_supabase_admin()
+        await (
+            sb.table("research_sessions")
+            .delete()
+            .eq("id", session_id)
+            .eq("user_id", user_id)
+            .execute()
+        )
         return True
     except Exception as e:
         print(f"[DB] Failed to delete session {session_id}: {e}")
         return False
-
@@ -0,0 +1,42 @@
+import os
+import asyncio
+import asyncpg
+
+
+_pool: asyncpg.Pool | None = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool() -> asyncpg.Pool | None:
+    """Return the shared asyncpg pool for Supabase's Postgres database.
+
+    Returns None when SUPABASE_DB_URL is not set, in which case callers fall
+    back to the PostgREST client. The URL must be a direct or session-mode
+    connection: Supabase's transaction-mode pooler breaks the prepared
+    statement cache. Sizing is per process (DB_POOL_MIN, DB_POOL_MAX,
+    DB_STATEMENT_CACHE).
+    """
+    global _pool
+    if _pool is not None:
+        return _pool
+    dsn = os.environ.get("SUPABASE_DB_URL")
+    if not dsn:
+        return None
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                dsn,
+                min_size=int(os.environ.get("DB_POOL_MIN", 2)),
+                max_size=int(os.environ.get("DB_POOL_MAX", 20)),
+                max_inactive_connection_lifetime=300,
+                statement_cache_size=int(os.environ.get("DB_STATEMENT_CACHE", 100)),
+            )
+        return _pool
+
+
+async def close_pool() -> None:
+    """Close the shared pool, if one was created."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
@@ -1,3 +1,4 @@
+import functools
 from langgraph.graph import StateGraph, END
 from agent.state import AgentState
 from agent.nodes import planner, searcher, evaluator, summarizer
@@ -31,3 +32,13 @@ def build_graph():
     workflow.add_edge("summarizer", END)
     
     return workflow.compile()
+
+
+@functools.cache
+def get_graph():
+    """Return the compiled graph, building it on first use.
+
+    build_graph() takes no configuration yet; once it does (model, tools),
+    add them as hashable parameters here so each variant compiles once.
+    """
+    return build_graph()
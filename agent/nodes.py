@@ -1,171 +1,310 @@
 import asyncio
+import functools
+import hashlib
+import re
+from dataclasses import dataclass
 from typing import Dict, Any
 from langchain_core.runnables import RunnableConfig
 from langchain_google_genai import ChatGoogleGenerativeAI
 from tavily import AsyncTavilyClient
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
+from pydantic import BaseModel
 from agent.state import AgentState, SubQueries, EvaluationResult
+from agent.stream import MessageStream
 import os
 
-# Models initialized lazily or using env vars directly
-def get_planner(): return ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0, api_key=os.environ.get("GOOGLE_API_KEY"))
-def get_evaluator(): return ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0, api_key=os.environ.get("GOOGLE_API_KEY"))
-def get_summarizer(): return ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.2, api_key=os.environ.get("GOOGLE_API_KEY"))
+@dataclass(frozen=True)
+class NodesConfig:
+    """Per-environment node settings, read once from env vars at import."""
+    planner_model: str = "gemini-2.5-flash"
+    evaluator_model: str = "gemini-2.5-flash"
+    summarizer_model: str = "gemini-2.5-flash"
+    gemini_max_rpm: int = 15
+    tavily_max_rps: int = 5
+    max_loops: int = 2
+    # Evaluator skips Gemini when at least min_blocks result blocks each
+    # mention this fraction of the query's key terms in their own snippets
+    min_blocks: int = 3
+    keyword_overlap: float = 1.0
+
+    @classmethod
+    def from_env(cls) -> "NodesConfig":
+        return cls(
+            planner_model=os.environ.get("PLANNER_MODEL", cls.planner_model),
+            evaluator_model=os.environ.get("EVALUATOR_MODEL", cls.evaluator_model),
+            summarizer_model=os.environ.get("SUMMARIZER_MODEL", cls.summarizer_model),
+            gemini_max_rpm=int(os.environ.get("GEMINI_MAX_RPM", cls.gemini_max_rpm)),
+            tavily_max_rps=int(os.environ.get("TAVILY_MAX_RPS", cls.tavily_max_rps)),
+            max_loops=int(os.environ.get("MAX_LOOPS", cls.max_loops)),
+            min_blocks=int(os.environ.get("EVAL_MIN_BLOCKS", cls.min_blocks)),
+            keyword_overlap=float(os.environ.get("EVAL_KEYWORD_OVERLAP", cls.keyword_overlap)),
+        )
+
+CONFIG = NodesConfig.from_env()
+
+# Clients are built on first use and then shared, so every node invocation
+# reuses the same HTTP session and structured-output wrapper.
+@functools.lru_cache(maxsize=1)
+def get_planner(): return ChatGoogleGenerativeAI(model=CONFIG.planner_model, temperature=0, api_key=os.environ.get("GOOGLE_API_KEY")).with_structured_output(SubQueries)
+@functools.lru_cache(maxsize=1)
+def get_evaluator(): return ChatGoogleGenerativeAI(model=CONFIG.evaluator_model, temperature=0, api_key=os.environ.get("GOOGLE_API_KEY")).with_structured_output(EvaluationResult)
+@functools.lru_cache(maxsize=1)
+def get_summarizer(): return ChatGoogleGenerativeAI(model=CONFIG.summarizer_model, temperature=0.2, api_key=os.environ.get("GOOGLE_API_KEY"))
+@functools.lru_cache(maxsize=1)
 def get_tavily(): return AsyncTavilyClient(api_key=os.environ.get("TAVILY_API_KEY"))
 
-async def send_progress(queue: asyncio.Queue, node: str, message: str):
-    if queue:
-        await queue.put({"node": node, "message": message})
+# Process-wide rate limits shared by every concurrent graph run
+_tavily_limiter = AsyncLimiter(max_rate=CONFIG.tavily_max_rps, time_period=1)
+_gemini_limiter = AsyncLimiter(max_rate=CONFIG.gemini_max_rpm, time_period=60)
+
+# Prompt templates, built once at import and filled per call
+PLANNER_TMPL = (
+    "You are an expert autonomous research planner. Create a step-by-step research plan "
+    "and decompose this query into specific search queries (max 3).\n\nQuery: {q}{context}"
+)
+REPLAN_CONTEXT_TMPL = (
+    "\n\nPrevious attempt failed because: {reason}\nPlease adjust your research plan "
+    "and sub-queries accordingly to find the missing information."
+)
+EVAL_TMPL = (
+    "Original Query: {q}\n\nGathered Information:\n{r}\n\n"
+    "Does the gathered information sufficiently answer the query in detail? Reason step by step."
+)
+SUMMARY_TMPL = """Original Query: {q}
+
+Gathered Information:
+{r}
+
+Write a comprehensive final report to answer the query using the above information. Format nicely in Markdown.
+CRITICAL INSTRUCTIONS:
+1. Synthesize the findings completely.
+2. Resolve any contradictions across the provided sources.
+3. Explicitly state the confidence level of your conclusions based on the context.
+4. Cite your sources inline where appropriate."""
+
+# Structured planner/evaluator outputs keyed by SHA-256 of the final prompt,
+# so a re-plan loop that reissues an identical prompt skips Gemini entirely.
+_llm_cache: TTLCache = TTLCache(maxsize=512, ttl=300)
+
+async def _invoke_cached(llm, schema: type[BaseModel], prompt: str):
+    key = hashlib.sha256(f"{schema.__name__}\n{prompt}".encode()).hexdigest()
+    hit = _llm_cache.get(key)
+    if hit is not None:
+        return schema.model_validate_json(hit)
+    async with _gemini_limiter:
+        result = await llm.ainvoke(prompt)
+    if isinstance(result, schema):
+        _llm_cache[key] = result.model_dump_json()
+    return result
+
+def _snippet_hash(content: str) -> int:
+    return int.from_bytes(hashlib.blake2b(content.encode(), digest_size=8).digest(), "big")
+
+def render_results(results: list[dict], max_chars: int = 20_000, max_snippet_chars: int = 2_000) -> str:
+    """Render structured search results into prompt text.
+
+    Snippets are deduplicated by hash and capped at max_snippet_chars each,
+    with their source URL so the summarizer can cite it. When the total
+    exceeds max_chars the oldest text is cut, keeping the latest loop's results.
+    """
+    seen = set()
+    blocks = []
+    for entry in results:
+        lines = [f"Query: {entry['query']}", "Results:"]
+        for snippet in entry["snippets"]:
+            if snippet["hash"] in seen:
+                continue
+            seen.add(snippet["hash"])
+            content = snippet["content"][:max_snippet_chars]
+            lines.append(f"- [{snippet['url']}] {content}" if snippet["url"] else f"- {content}")
+        blocks.append("\n".join(lines))
+    joined = "\n\n".join(blocks)
+    return joined[-max_chars:] if len(joined) > max_chars else joined
+
+def _keyword_overlap(query: str, text: str) -> float:
+    """Fraction of the query's key terms (words over 3 chars) found in text."""
+    terms = {w for w in re.findall(r"\w+", query.lower()) if len(w) > 3}
+    if not terms:
+        return 0.0
+    words = set(re.findall(r"\w+", text.lower()))
+    return len(terms & words) / len(terms)
+
+def _evidence_text(entry: dict) -> str:
+    """Title and content of a block's real snippets (not empty, not a failed search)."""
+    return " ".join(
+        f"{s.get('title', '')} {s['content']}" for s in entry["snippets"]
+        if s["content"].strip() and not s.get("error")
+    )
+
+def send_progress(queue: MessageStream | None, node: str, message: str):
+    """Enqueue a progress line without blocking; the stream drops the oldest when full."""
+    if queue is not None:
+        queue.put_nowait({"node": node, "message": message})
 
 async def planner(state: AgentState, config: RunnableConfig):
     queue = config.get("configurable", {}).get("queue")
     loop_count = state.get("loop_count", 0)
 
     if loop_count > 0:
-        await send_progress(queue, "planner", f"Re-planning (attempt {loop_count + 1}) — previous data was insufficient.")
-        await send_progress(queue, "planner", f"Reason: {state.get('eval_reasoning', 'N/A')}")
+        send_progress(queue, "planner", f"Re-planning (attempt {loop_count + 1}) — previous data was insufficient.")
+        send_progress(queue, "planner", f"Reason: {state.get('eval_reasoning', 'N/A')}")
     else:
-        await send_progress(queue, "planner", f"Analyzing query: \"{state['query']}\"")
+        send_progress(queue, "planner", f"Analyzing query: \"{state['query']}\"")
+
+    send_progress(queue, "planner", "Calling Gemini to decompose query into sub-tasks...")
 
-    await send_progress(queue, "planner", "Calling Gemini to decompose query into sub-tasks...")
-    
-    # Rate limit protection
-    await asyncio.sleep(4)
-    
-    planner_model = get_planner()
-    
     context = ""
     if state.get("eval_reasoning"):
-        context = f"\n\nPrevious attempt failed because: {state['eval_reasoning']}\nPlease adjust your research plan and sub-queries accordingly to find the missing information."
-        
-    prompt = f"You are an expert autonomous research planner. Create a step-by-step research plan and decompose this query into specific search queries (max 3).\n\nQuery: {state['query']}{context}"
-    llm = planner_model.with_structured_output(SubQueries)
+        context = REPLAN_CONTEXT_TMPL.format_map({"reason": state["eval_reasoning"]})
+
+    prompt = PLANNER_TMPL.format_map({"q": state["query"], "context": context})
+    llm = get_planner()
     try:
-        result: SubQueries = await llm.ainvoke(prompt)
-        await send_progress(queue, "planner", f"Research plan: {result.research_plan}")
+        result: SubQueries = await _invoke_cached(llm, SubQueries, prompt)
+        send_progress(queue, "planner", f"Research plan: {result.research_plan}")
         for i, sq in enumerate(result.sub_queries, 1):
-            await send_progress(queue, "planner", f"Sub-query #{i}: \"{sq}\"")
-        await send_progress(queue, "planner", f"Planning complete — {len(result.sub_queries)} sub-queries ready for search.")
+            send_progress(queue, "planner", f"Sub-query #{i}: \"{sq}\"")
+        send_progress(queue, "planner", f"Planning complete — {len(result.sub_queries)} sub-queries ready for search.")
         return {"sub_queries": result.sub_queries}
     except Exception as e:
-        await send_progress(queue, "planner", f"Structured output failed ({type(e).__name__}), falling back to raw query.")
+        send_progress(queue, "planner", f"Structured output failed ({type(e).__name__}), falling back to raw query.")
         return {"sub_queries": [state["query"]]}
 
 async def searcher(state: AgentState, config: RunnableConfig):
     queue = config.get("configurable", {}).get("queue")
     sub_queries = state.get("sub_queries", [])
 
-    await send_progress(queue, "searcher", f"Starting web search — {len(sub_queries)} queries to execute.")
+    send_progress(queue, "searcher", f"Starting web search — {len(sub_queries)} queries to execute.")
     
     tavily_client = get_tavily()
     
     async def run_search(q, index):
         try:
-            await send_progress(queue, "searcher", f"Searching [{index+1}/{len(sub_queries)}]: \"{q}\"")
-            # Stagger concurrent searches slightly
-            await asyncio.sleep(index * 2) 
-            result = await tavily_client.search(q, search_depth="basic")
+            send_progress(queue, "searcher", f"Searching [{index+1}/{len(sub_queries)}]: \"{q}\"")
+            async with _tavily_limiter:
+                result = await tavily_client.search(q, search_depth="basic")
             num_results = len(result.get("results", []))
             # Extract source URLs
             sources = [r.get("url", "") for r in result.get("results", []) if r.get("url")]
             if sources:
                 top_sources = sources[:3]
-                await send_progress(queue, "searcher", f"Found {num_results} results for query #{index+1}. Sources: {', '.join(top_sources)}")
+                send_progress(queue, "searcher", f"Found {num_results} results for query #{index+1}. Sources: {', '.join(top_sources)}")
             else:
-                await send_progress(queue, "searcher", f"Found {num_results} results for query #{index+1}.")
+                send_progress(queue, "searcher", f"Found {num_results} results for query #{index+1}.")
             return result
         except Exception as e:
-            await send_progress(queue, "searcher", f"Search #{index+1} failed: {type(e).__name__}: {e}")
-            return {"results": [{"content": str(e)}]}
+            send_progress(queue, "searcher", f"Search #{index+1} failed: {type(e).__name__}: {e}")
+            return {"results": [{"content": str(e), "error": True}]}
             
     results_lists = await asyncio.gather(*(run_search(q, i) for i, q in enumerate(sub_queries)))
     
-    formatted_results = []
+    new_results = []
     total_snippets = 0
+    seen_hashes = set(state.get("seen_hashes") or ())
     for q, res in zip(sub_queries, results_lists):
         if "results" in res:
-            snippets = res["results"]
-            total_snippets += len(snippets)
-            content = "\n".join([r.get("content", "") for r in snippets])
-            formatted_results.append(f"Query: {q}\nResults: {content}\n")
+            total_snippets += len(res["results"])
+            snippets = []
+            for r in res["results"]:
+                content = r.get("content", "")
+                # Skip snippets already gathered on a previous loop
+                h = _snippet_hash(content)
+                if h not in seen_hashes:
+                    seen_hashes.add(h)
+                    snippets.append({
+                        "url": r.get("url", ""),
+                        "title": r.get("title", ""),
+                        "content": content,
+                        "hash": h,
+                        "error": bool(r.get("error")),
+                    })
+            # A block whose snippets were all seen before adds only headers
+            if snippets:
+                new_results.append({"query": q, "snippets": snippets})
     
-    await send_progress(queue, "searcher", f"All searches complete — collected {total_snippets} content snippets from {len(sub_queries)} queries.")
+    send_progress(queue, "searcher", f"All searches complete — collected {total_snippets} content snippets from {len(sub_queries)} queries.")
     
-    current_results = state.get("search_results", []) or []
-    current_results.extend(formatted_results)
-    
-    return {"search_results": current_results}
+    # Build a new list rather than mutating the state's list in place
+    return {
+        "search_results": [*(state.get("search_results") or ()), *new_results],
+        "seen_hashes": seen_hashes,
+    }
 
 async def evaluator(state: AgentState, config: RunnableConfig):
     queue = config.get("configurable", {}).get("queue")
     loop_count = state.get("loop_count", 0)
     num_results = len(state.get("search_results", []))
 
-    await send_progress(queue, "evaluator", f"Evaluating {num_results} search result blocks (loop {loop_count + 1}/2)...")
-    await send_progress(queue, "evaluator", "Calling Gemini to assess data quality and completeness...")
-    
-    # Rate limit protection
-    await asyncio.sleep(4)
-    
+    send_progress(queue, "evaluator", f"Evaluating {num_results} search result blocks (loop {loop_count + 1}/{CONFIG.max_loops})...")
+
+    # The verdict on the last allowed loop is forced to sufficient anyway,
+    # so skip the Gemini call entirely.
+    if loop_count + 1 >= CONFIG.max_loops:
+        send_progress(queue, "evaluator", "Verdict: MAX LOOPS REACHED")
+        send_progress(queue, "evaluator", "Proceeding to report generation →")
+        return {"is_sufficient": True, "loop_count": loop_count + 1, "eval_reasoning": "Max loops (short-circuit)."}
+
     query = state["query"]
-    results = "\n\n".join(state.get("search_results", []))
-    
-    prompt = f"Original Query: {query}\n\nGathered Information:\n{results}\n\nDoes the gathered information sufficiently answer the query in detail? Reason step by step."
+    results = render_results(state.get("search_results", []))
+
+    # Scored per block on snippet text only: the "Query:" headers in `results`
+    # echo the user's own terms and would pass the check with no evidence.
+    covered = sum(
+        1 for entry in state.get("search_results", [])
+        if _keyword_overlap(query, _evidence_text(entry)) >= CONFIG.keyword_overlap
+    )
+    if covered >= CONFIG.min_blocks:
+        send_progress(queue, "evaluator", f"Verdict: SUFFICIENT — {covered} result blocks each mention at least {CONFIG.keyword_overlap:.0%} of the query's key terms.")
+        send_progress(queue, "evaluator", "Proceeding to report generation →")
+        return {"is_sufficient": True, "loop_count": loop_count + 1, "eval_reasoning": "Keyword coverage (short-circuit)."}
+
+    send_progress(queue, "evaluator", "Calling Gemini to assess data quality and completeness...")
+
+    prompt = EVAL_TMPL.format_map({"q": query, "r": results})
     
-    evaluator_model = get_evaluator()
-    llm = evaluator_model.with_structured_output(EvaluationResult)
+    llm = get_evaluator()
     try:
-        result: EvaluationResult = await llm.ainvoke(prompt)
+        result: EvaluationResult = await _invoke_cached(llm, EvaluationResult, prompt)
         loop_count = state.get("loop_count", 0) + 1
         
-        if result.is_sufficient or loop_count >= 2:
+        if result.is_sufficient or loop_count >= CONFIG.max_loops:
             verdict = "SUFFICIENT" if result.is_sufficient else "MAX LOOPS REACHED"
-            await send_progress(queue, "evaluator", f"Verdict: {verdict}")
-            await send_progress(queue, "evaluator", f"Reasoning: {result.reasoning}")
-            await send_progress(queue, "evaluator", "Proceeding to report generation →")
+            send_progress(queue, "evaluator", f"Verdict: {verdict}")
+            send_progress(queue, "evaluator", f"Reasoning: {result.reasoning}")
+            send_progress(queue, "evaluator", "Proceeding to report generation →")
             return {"is_sufficient": True, "loop_count": loop_count, "eval_reasoning": result.reasoning}
         else:
-            await send_progress(queue, "evaluator", f"Verdict: INSUFFICIENT — needs more data.")
-            await send_progress(queue, "evaluator", f"Reasoning: {result.reasoning}")
-            await send_progress(queue, "evaluator", "Looping back to planner for refined queries →")
+            send_progress(queue, "evaluator", f"Verdict: INSUFFICIENT — needs more data.")
+            send_progress(queue, "evaluator", f"Reasoning: {result.reasoning}")
+            send_progress(queue, "evaluator", "Looping back to planner for refined queries →")
             return {"is_sufficient": False, "loop_count": loop_count, "eval_reasoning": result.reasoning}
     except Exception as e:
          loop_count = state.get("loop_count", 0) + 1
-         await send_progress(queue, "evaluator", f"Evaluation error ({type(e).__name__}), proceeding with current data.")
+         send_progress(queue, "evaluator", f"Evaluation error ({type(e).__name__}), proceeding with current data.")
          return {"is_sufficient": True, "loop_count": loop_count, "eval_reasoning": "Fallback evaluation."}
 
 async def summarizer(state: AgentState, config: RunnableConfig):
     queue = config.get("configurable", {}).get("queue")
     num_results = len(state.get("search_results", []))
 
-    await send_progress(queue, "summarizer", f"Synthesizing final report from {num_results} data blocks...")
-    await send_progress(queue, "summarizer", "Calling Gemini to generate comprehensive markdown report...")
-    
-    # Rate limit protection
-    await asyncio.sleep(4)
-    
+    send_progress(queue, "summarizer", f"Synthesizing final report from {num_results} data blocks...")
+    send_progress(queue, "summarizer", "Calling Gemini to generate comprehensive markdown report...")
+
     query = state["query"]
-    results = "\n\n".join(state.get("search_results", []))
-    
-    prompt = f"""Original Query: {query}
+    results = render_results(state.get("search_results", []))
     
-Gathered Information:
-{results}
+    prompt = SUMMARY_TMPL.format_map({"q": query, "r": results})
 
-Write a comprehensive final report to answer the query using the above information. Format nicely in Markdown.
-CRITICAL INSTRUCTIONS:
-1. Synthesize the findings completely. 
-2. Resolve any contradictions across the provided sources. 
-3. Explicitly state the confidence level of your conclusions based on the context.
-4. Cite your sources inline where appropriate."""
-    
     summarizer_model = get_summarizer()
 
-    await send_progress(queue, "summarizer", "Waiting for Gemini response...")
-    response = await summarizer_model.ainvoke(prompt)
+    send_progress(queue, "summarizer", "Waiting for Gemini response...")
+    async with _gemini_limiter:
+        response = await summarizer_model.ainvoke(prompt)
 
     report_len = len(response.content)
     word_count = len(response.content.split())
-    await send_progress(queue, "summarizer", f"Report generated — {word_count} words, {report_len} characters.")
-    await send_progress(queue, "summarizer", "Report ready ✓")
+    send_progress(queue, "summarizer", f"Report generated — {word_count} words, {report_len} characters.")
+    send_progress(queue, "summarizer", "Report ready ✓")
     
     return {"report": response.content}
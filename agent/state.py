@@ -1,11 +1,28 @@
-from typing import TypedDict, List
+from typing import TypedDict, List, Set
 from pydantic import BaseModel, Field
 
+class Snippet(TypedDict):
+    """A single search hit, hashed on its content for deduplication.
+
+    `error` marks a placeholder carrying a failed search's message.
+    """
+    url: str
+    title: str
+    content: str
+    hash: int
+    error: bool
+
+class SearchResult(TypedDict):
+    """All snippets gathered for one sub-query."""
+    query: str
+    snippets: List[Snippet]
+
 class AgentState(TypedDict):
     """The State of the Autonomous Research Agent."""
     query: str
     sub_queries: List[str]
-    search_results: List[str]
+    search_results: List[SearchResult]
+    seen_hashes: Set[int]
     report: str
     loop_count: int
     is_sufficient: bool
@@ -0,0 +1,27 @@
+import asyncio
+from collections import deque
+
+
+class MessageStream:
+    """Single-producer, single-consumer buffer for agent → WebSocket messages.
+
+    A bounded deque plus one asyncio.Event, instead of asyncio.Queue's
+    per-item futures. When full, the oldest message is dropped, so the final
+    message put is always delivered.
+    """
+
+    def __init__(self, maxlen: int = 256):
+        self._buf: deque = deque(maxlen=maxlen)
+        self._ready = asyncio.Event()
+
+    def put_nowait(self, msg: dict) -> None:
+        self._buf.append(msg)
+        self._ready.set()
+
+    async def get_batch(self) -> list[dict]:
+        """Wait for at least one message, then return everything buffered."""
+        await self._ready.wait()
+        self._ready.clear()
+        batch = list(self._buf)
+        self._buf.clear()
+        return batch
@@ -1,34 +1,237 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Depends
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response, FileResponse
+from pydantic import BaseModel, EmailStr, Field
 import asyncio
+import base64
+import gzip
+import hashlib
+import hmac
+import mimetypes
 import os
-from agent.graph import build_graph
-from agent.db import (
-    save_session, list_sessions, get_session_by_id, delete_session,
-    verify_token, sign_up, sign_in,
-)
+import secrets
+import time
+import traceback
+import orjson
 from dotenv import load_dotenv
 
+# Load .env before importing agent modules, which read their config at import
 load_dotenv()
 
+from agent.graph import get_graph
+from agent.db import (
+    save_session, list_sessions, get_session_full, delete_session,
+    sign_up, sign_in, close_http,
+)
+from agent.auth_cache import cached_verify_token
+from agent.db_pool import get_pool, close_pool
+from agent.stream import MessageStream
+
 app = FastAPI(title="Autonomous Research Agent")
 
+# Small files under public/ are read once and served from memory; anything
+# larger falls through to StaticFiles.
+ASSET_MAX_BYTES = 256 * 1024
+
+
+def _load_assets(root: str = "public") -> dict[str, tuple[bytes, str, str]]:
+    """Map each small file's path under `root` to (bytes, content type, ETag)."""
+    assets = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.getsize(path) > ASSET_MAX_BYTES:
+                continue
+            with open(path, "rb") as f:
+                body = f.read()
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            assets[os.path.relpath(path, root).replace(os.sep, "/")] = (body, content_type, etag)
+    return assets
+
+
+_ASSET_CACHE = _load_assets()
+
+
+def cached_asset_response(request: Request, entry: tuple[bytes, str, str]) -> Response:
+    body, content_type, etag = entry
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=60"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=content_type, headers=headers)
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that answers from _ASSET_CACHE before touching the disk.
+
+    Mounted only at /static, so API routes never pass through it.
+    """
+
+    async def get_response(self, path: str, scope) -> Response:
+        entry = _ASSET_CACHE.get(path.replace(os.sep, "/"))
+        if entry is not None and scope["method"] in ("GET", "HEAD"):
+            return cached_asset_response(Request(scope), entry)
+        return await super().get_response(path, scope)
+
+
 os.makedirs("public", exist_ok=True)
-app.mount("/static", StaticFiles(directory="public"), name="static")
+app.mount("/static", CachedStaticFiles(directory="public"), name="static")
+
+
+@app.on_event("startup")
+async def startup():
+    # Open the Postgres pool and compile the graph before the first request
+    await get_pool()
+    get_graph()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_pool()
+    await close_http()
 
 
 # ──────────────────────────────────────────────
 #  Helpers
 # ──────────────────────────────────────────────
 
+class Unauthorized(Exception):
+    """Raised by current_user when the request carries no valid token."""
+
+
+@app.exception_handler(Unauthorized)
+async def unauthorized_handler(request: Request, exc: Unauthorized):
+    return JSONResponse(content={"error": "Unauthorized"}, status_code=401)
+
+
+def bearer_token(request: Request) -> str | None:
+    """Return the Bearer token from the Authorization header, if any."""
+    auth = request.headers.get("authorization") or ""
+    if auth[:7].lower() != "bearer ":
+        return None
+    return auth[7:]
+
+
 async def get_user_from_request(request: Request) -> dict | None:
     """Extract and verify the Bearer token from the Authorization header."""
-    auth = request.headers.get("authorization", "")
-    if not auth.startswith("Bearer "):
+    token = bearer_token(request)
+    if token is None:
+        return None
+    return await cached_verify_token(token)
+
+
+# Short-lived signed session cookie issued at login, so /auth/me can confirm
+# a warm session locally without a Supabase round trip. The MAC covers a
+# digest of the access token it was issued with, so the cookie only vouches
+# for requests presenting that same Bearer token.
+SESSION_COOKIE = "sid"
+SESSION_COOKIE_MAX_AGE = 300
+# Without SESSION_SECRET a per-process key is used; cookies then only
+# validate on the worker that issued them and others fall back to the token.
+_SESSION_KEY = hashlib.sha256(
+    os.environ.get("SESSION_SECRET", "").encode() or secrets.token_bytes(32)
+).digest()
+
+
+def _sign(payload: bytes, token: str) -> bytes:
+    mac = hashlib.blake2b(payload, key=_SESSION_KEY, digest_size=32)
+    mac.update(hashlib.sha256(token.encode()).digest())
+    return mac.digest()
+
+
+def make_session_cookie(user: dict, token: str) -> str:
+    exp = int(time.time()) + SESSION_COOKIE_MAX_AGE
+    payload = f"{user['id']}|{exp}|{user.get('email') or ''}".encode()
+    mac = _sign(payload, token)
+    return f"{base64.urlsafe_b64encode(payload).decode()}.{base64.urlsafe_b64encode(mac).decode()}"
+
+
+def read_session_cookie(value: str | None, token: str | None) -> dict | None:
+    """Return the user from a valid, unexpired cookie issued for `token`, else None."""
+    if not value or not token:
+        return None
+    try:
+        payload_b64, _, mac_b64 = value.partition(".")
+        payload = base64.urlsafe_b64decode(payload_b64)
+        if not hmac.compare_digest(_sign(payload, token), base64.urlsafe_b64decode(mac_b64)):
+            return None
+        user_id, exp, email = payload.decode().split("|", 2)
+    except ValueError:
+        return None
+    if int(exp) <= time.time():
         return None
-    token = auth.split(" ", 1)[1]
-    return await verify_token(token)
+    return {"id": user_id, "email": email or None}
+
+
+def with_session_cookie(response: Response, result: dict) -> Response:
+    """Attach a session cookie for a successful sign_in/sign_up result."""
+    if not result.get("access_token"):
+        return response
+    response.set_cookie(
+        SESSION_COOKIE, make_session_cookie(result["user"], result["access_token"]),
+        max_age=SESSION_COOKIE_MAX_AGE, httponly=True, secure=True, samesite="strict",
+    )
+    return response
+
+
+async def current_user(request: Request) -> dict:
+    """Dependency resolving the authenticated user, once per request."""
+    user = getattr(request.state, "user", None)
+    if user is None:
+        user = await get_user_from_request(request)
+        if not user:
+            raise Unauthorized()
+        request.state.user = user
+    return user
+
+
+async def send_ws_json(websocket: WebSocket, data) -> None:
+    """Send `data` as a JSON text frame, encoded with orjson."""
+    await websocket.send_text(orjson.dumps(data).decode())
+
+
+async def stream_batches(queue: MessageStream):
+    """Yield everything buffered since the last send, one batch per frame.
+
+    Ends after the batch holding the terminal "Task Completed" message.
+    """
+    while True:
+        batch = await queue.get_batch()
+        yield batch
+        last = batch[-1]
+        if last["node"] == "system" and last["message"].startswith("Task Completed"):
+            return
+
+
+COMPRESS_MIN_BYTES = 4096
+
+
+def report_payload(report: str) -> dict:
+    """Message fields carrying `report`, gzip+base64 encoded when it is large.
+
+    gzip rather than zstd so the browser can use its native DecompressionStream.
+    """
+    raw = report.encode()
+    if len(raw) <= COMPRESS_MIN_BYTES:
+        return {"report": report}
+    blob = gzip.compress(raw, compresslevel=6)
+    return {"report_b64": base64.b64encode(blob).decode(), "compressed": "gzip"}
+
+
+def encode_cursor(cursor: tuple[str, int]) -> str:
+    """Opaque, URL-safe form of a list_sessions (created_at, id) cursor."""
+    raw = f"{cursor[0]}|{cursor[1]}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(value: str) -> tuple[str, int]:
+    """Inverse of encode_cursor; raises ValueError for anything malformed."""
+    raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+    created_at, _, last_id = raw.rpartition("|")
+    if not last_id.isdigit():
+        raise ValueError("invalid cursor id")
+    return created_at, int(last_id)
 
 
 # ──────────────────────────────────────────────
@@ -36,46 +239,66 @@ async def get_user_from_request(request: Request) -> dict | None:
 # ──────────────────────────────────────────────
 
 @app.get("/")
-async def get_index():
-    return FileResponse("public/index.html")
+async def get_index(request: Request):
+    entry = _ASSET_CACHE.get("index.html")
+    if entry is None:
+        # Larger than ASSET_MAX_BYTES, so it was never cached
+        return FileResponse("public/index.html")
+    return cached_asset_response(request, entry)
 
 
 # ──────────────────────────────────────────────
 #  Auth endpoints
 # ──────────────────────────────────────────────
 
+class AuthIn(BaseModel):
+    email: EmailStr
+    password: str = Field(min_length=1)
+
+
+@app.exception_handler(RequestValidationError)
+async def validation_error_handler(request: Request, exc: RequestValidationError):
+    """Report request validation errors in the app's {"error": ...} shape."""
+    err = exc.errors()[0]
+    field = ".".join(str(p) for p in err["loc"][1:]) or str(err["loc"][0])
+    if err["type"] == "missing":
+        return JSONResponse(content={"error": f"{field} is required"}, status_code=400)
+    return JSONResponse(content={"error": f"Invalid {field}: {err['msg']}"}, status_code=400)
+
+
 @app.post("/auth/signup")
-async def auth_signup(request: Request):
-    body = await request.json()
-    email = body.get("email", "").strip()
-    password = body.get("password", "")
-    if not email or not password:
-        return JSONResponse(content={"error": "Email and password are required"}, status_code=400)
-    result = await sign_up(email, password)
+async def auth_signup(payload: AuthIn):
+    result = await sign_up(payload.email, payload.password)
     if "error" in result:
         return JSONResponse(content=result, status_code=400)
-    return JSONResponse(content=result)
+    return with_session_cookie(JSONResponse(content=result), result)
 
 
 @app.post("/auth/login")
-async def auth_login(request: Request):
-    body = await request.json()
-    email = body.get("email", "").strip()
-    password = body.get("password", "")
-    if not email or not password:
-        return JSONResponse(content={"error": "Email and password are required"}, status_code=400)
-    result = await sign_in(email, password)
+async def auth_login(payload: AuthIn):
+    result = await sign_in(payload.email, payload.password)
     if "error" in result:
         return JSONResponse(content=result, status_code=401)
-    return JSONResponse(content=result)
+    return with_session_cookie(JSONResponse(content=result), result)
+
+
+@app.post("/auth/logout")
+async def auth_logout():
+    response = JSONResponse(content={"status": "success"})
+    response.delete_cookie(SESSION_COOKIE, httponly=True, secure=True, samesite="strict")
+    return response
 
 
 @app.get("/auth/me")
 async def auth_me(request: Request):
-    """Verify the current token and return user info."""
-    user = await get_user_from_request(request)
-    if not user:
-        return JSONResponse(content={"error": "Unauthorized"}, status_code=401)
+    """Verify the current session and return user info.
+
+    A valid session cookie issued for the presented Bearer token is checked
+    locally first; only on a miss is the token verified against Supabase.
+    """
+    user = read_session_cookie(request.cookies.get(SESSION_COOKIE), bearer_token(request))
+    if user is None:
+        user = await current_user(request)
     return JSONResponse(content={"user": user})
 
 
@@ -84,33 +307,34 @@ async def auth_me(request: Request):
 # ──────────────────────────────────────────────
 
 @app.get("/sessions")
-async def get_sessions(request: Request):
-    """Return list of sessions for the authenticated user."""
-    user = await get_user_from_request(request)
-    if not user:
-        return JSONResponse(content={"error": "Unauthorized"}, status_code=401)
-    sessions = await list_sessions(user["id"])
-    return JSONResponse(content=sessions)
+async def get_sessions(cursor: str | None = None, limit: int = 20, user: dict = Depends(current_user)):
+    """Return a page of sessions for the authenticated user.
+
+    `cursor` is the opaque `next_cursor` value from the previous page.
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+        page = await list_sessions(user["id"], cursor=after, limit=max(1, min(limit, 100)))
+    except ValueError:
+        return JSONResponse(content={"error": "Invalid cursor"}, status_code=400)
+    next_cursor = page["next_cursor"]
+    return JSONResponse(content={
+        "items": page["items"],
+        "next_cursor": encode_cursor(next_cursor) if next_cursor else None,
+    })
 
 
 @app.get("/sessions/{session_id}")
-async def get_session(session_id: int, request: Request):
+async def get_session(session_id: int, user: dict = Depends(current_user)):
     """Return a specific research session for the authenticated user."""
-    user = await get_user_from_request(request)
-    if not user:
-        return JSONResponse(content={"error": "Unauthorized"}, status_code=401)
-    session = await get_session_by_id(session_id, user["id"])
+    session = await get_session_full(session_id, user["id"])
     if not session:
         return JSONResponse(content={"error": "Session not found"}, status_code=404)
     return JSONResponse(content=session)
 
 
 @app.delete("/sessions/{session_id}")
-async def remove_session(session_id: int, request: Request):
-    user = await get_user_from_request(request)
-    if not user:
-        return JSONResponse(content={"error": "Unauthorized"}, status_code=401)
-    
+async def remove_session(session_id: int, user: dict = Depends(current_user)):
     success = await delete_session(session_id, user["id"])
     if not success:
         return JSONResponse(content={"error": "Failed to delete session"}, status_code=500)
@@ -132,52 +356,66 @@ async def websocket_endpoint(websocket: WebSocket):
         token = data.get("token")
 
         if not query:
-            await websocket.send_json({"node": "error", "message": "No query provided"})
+            await send_ws_json(websocket, {"node": "error", "message": "No query provided"})
             return
 
         # Verify auth token
-        user = await verify_token(token) if token else None
+        user = await cached_verify_token(token) if token else None
         if not user:
-            await websocket.send_json({"node": "error", "message": "Unauthorized. Please log in."})
+            await send_ws_json(websocket, {"node": "error", "message": "Unauthorized. Please log in."})
             return
 
         user_id = user["id"]
-        queue = asyncio.Queue()
-        agent_graph = build_graph()
+        queue = MessageStream(maxlen=256)
 
         async def run_agent():
             try:
                 config = {"configurable": {"queue": queue}}
-                final_state = await agent_graph.ainvoke({"query": query, "loop_count": 0}, config)
+                final_state = await get_graph().ainvoke({"query": query, "loop_count": 0}, config)
                 report = final_state.get("report", "")
 
-                # Persist session to Supabase with user_id
-                saved = await save_session(query, report, user_id)
-                session_id = saved.get("id")
+                # Persist session to Supabase while the report is already
+                # on its way to the client; the id follows once saved.
+                save_task = asyncio.create_task(save_session(query, report, user_id))
+                queue.put_nowait({"node": "system", "message": "Report ready", **report_payload(report)})
+                # Shielded: a client dropping now should not lose a finished report
+                saved = await asyncio.shield(save_task)
 
-                await queue.put({
+                queue.put_nowait({
                     "node": "system",
                     "message": "Task Completed",
-                    "report": report,
-                    "session_id": session_id,
+                    "session_id": saved.get("id"),
                 })
             except Exception as e:
-                import traceback
                 traceback.print_exc()
-                await queue.put({"node": "error", "message": str(e)})
-                await queue.put({
+                queue.put_nowait({"node": "error", "message": str(e)})
+                queue.put_nowait({
                     "node": "system",
                     "message": "Task Completed (Error)",
                     "report": f"An error occurred: {e}",
                 })
 
-        task = asyncio.create_task(run_agent())
-
-        while True:
-            msg = await queue.get()
-            await websocket.send_json(msg)
-            if msg.get("node") == "system" and msg.get("message", "").startswith("Task Completed"):
-                break
+        async def watch_disconnect():
+            # The client sends nothing after the query, so receive() only
+            # returns once it goes away
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+
+        # A disconnect fails the group, which cancels the agent run and its
+        # in-flight LLM/search calls instead of letting it burn tokens.
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(run_agent(), name=f"agent:{user_id}")
+                watcher = tg.create_task(watch_disconnect(), name=f"agent-ws:{user_id}")
+
+                async for batch in stream_batches(queue):
+                    await send_ws_json(websocket, batch[0] if len(batch) == 1 else batch)
+
+                watcher.cancel()
+        except* WebSocketDisconnect:
+            print("Client disconnected, agent run cancelled")
 
     except WebSocketDisconnect:
         print("Client disconnected")
@@ -0,0 +1,9 @@
+-- NOTE: CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+-- Apply this file on its own (e.g. `psql -f`), not through a runner that
+-- wraps each migration in a transaction such as the Supabase CLI; there,
+-- drop CONCURRENTLY and accept the brief write lock on research_sessions.
+-- Keyset pagination index for list_sessions (agent/db.py):
+--   WHERE user_id = $1 [AND (created_at, id) < ($2, $3)]
+--   ORDER BY created_at DESC, id DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_research_sessions_user_created
+    ON research_sessions (user_id, created_at DESC, id DESC);
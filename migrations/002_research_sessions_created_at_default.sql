@@ -0,0 +1,3 @@
+-- save_session (agent/db.py) relies on the database to stamp created_at and
+-- reads it back via RETURNING in the same round trip.
+ALTER TABLE research_sessions ALTER COLUMN created_at SET DEFAULT now();
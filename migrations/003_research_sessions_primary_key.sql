@@ -0,0 +1,13 @@
+-- get_session_full/delete_session (agent/db.py) filter on
+-- id = $1 AND user_id = $2. The primary key on id makes that an index lookup;
+-- ix_research_sessions_user_created (001) covers the user_id side.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'research_sessions'::regclass AND contype = 'p'
+    ) THEN
+        ALTER TABLE research_sessions ADD PRIMARY KEY (id);
+    END IF;
+END
+$$;
@@ -0,0 +1,15 @@
+-- Row-level security for the asyncpg read/delete path in agent/db.py, which
+-- runs each query as the `authenticated` role with the user's JWT claims.
+-- No anon policies are granted: the PostgREST fallback (no SUPABASE_DB_URL)
+-- uses SUPABASE_SERVICE_KEY, which bypasses RLS and is required at import.
+ALTER TABLE research_sessions ENABLE ROW LEVEL SECURITY;
+
+GRANT SELECT, DELETE ON research_sessions TO authenticated;
+
+DROP POLICY IF EXISTS research_sessions_select_own ON research_sessions;
+CREATE POLICY research_sessions_select_own ON research_sessions
+    FOR SELECT TO authenticated USING (user_id = auth.uid());
+
+DROP POLICY IF EXISTS research_sessions_delete_own ON research_sessions;
+CREATE POLICY research_sessions_delete_own ON research_sessions
+    FOR DELETE TO authenticated USING (user_id = auth.uid());